@@ -10,10 +10,14 @@ class Migration(migrations.Migration):
         ('django_etebase', '0017_auto_20200623_0958'),
     ]
 
+    # Only the validator changes here, which doesn't exist at the database level, so skip
+    # emitting any SQL (on sqlite the AlterField would otherwise rebuild the whole table).
     operations = [
-        migrations.AlterField(
-            model_name='collectionitem',
-            name='uid',
-            field=models.CharField(db_index=True, max_length=43, validators=[django.core.validators.RegexValidator(message='Not a valid UID', regex='^[a-zA-Z0-9\\-_]*$')]),
-        ),
+        migrations.SeparateDatabaseAndState(state_operations=[
+            migrations.AlterField(
+                model_name='collectionitem',
+                name='uid',
+                field=models.CharField(db_index=True, max_length=43, validators=[django.core.validators.RegexValidator(message='Not a valid UID', regex='^[a-zA-Z0-9\\-_]*$')]),
+            ),
+        ]),
     ]
@@ -0,0 +1,43 @@
+from django.db import migrations, models
+import django_etebase.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_etebase', '0032_auto_20201013_1409'),
+    ]
+
+    # Swapping the uid validator doesn't touch the schema, so only update the migration state.
+    operations = [
+        migrations.SeparateDatabaseAndState(state_operations=[
+            migrations.AlterField(
+                model_name='collectioninvitation',
+                name='uid',
+                field=models.CharField(db_index=True, max_length=43, validators=[django_etebase.models.validate_uid]),
+            ),
+            migrations.AlterField(
+                model_name='collectionitem',
+                name='uid',
+                field=models.CharField(db_index=True, max_length=43, validators=[django_etebase.models.validate_uid]),
+            ),
+            migrations.AlterField(
+                model_name='collectionitemchunk',
+                name='uid',
+                field=models.CharField(db_index=True, max_length=60, validators=[django_etebase.models.validate_uid]),
+            ),
+            migrations.AlterField(
+                model_name='collectionitemrevision',
+                name='uid',
+                field=models.CharField(db_index=True, max_length=43, unique=True,
+                                       validators=[django_etebase.models.validate_uid]),
+            ),
+            migrations.AlterField(
+                model_name='stoken',
+                name='uid',
+                field=models.CharField(db_index=True, default=django_etebase.models.generate_stoken_uid,
+                                       max_length=43, unique=True,
+                                       validators=[django_etebase.models.validate_uid]),
+            ),
+        ]),
+    ]
@@ -16,7 +16,7 @@ from pathlib import Path
 
 from django.db import models, transaction
 from django.conf import settings
-from django.core.validators import RegexValidator
+from django.core.exceptions import ValidationError
 from django.db.models import Q
 from django.utils.functional import cached_property
 from django.utils.crypto import get_random_string
@@ -27,7 +27,13 @@ from . import app_settings
 from .exceptions import EtebaseValidationError
 
 
-UidValidator = RegexValidator(regex=r'^[a-zA-Z0-9\-_]{20,}$', message='Not a valid UID')
+UID_ALLOWED_CHARS = frozenset('abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789-_')
+
+
+def validate_uid(value):
+    """Validate a base64url UID with a C-level charset check instead of a regex match"""
+    if len(value) < 20 or not UID_ALLOWED_CHARS.issuperset(value):
+        raise ValidationError('Not a valid UID', code='invalid')
 
 
 class CollectionType(models.Model):
@@ -78,7 +84,7 @@ class Collection(models.Model):
 
 class CollectionItem(models.Model):
     uid = models.CharField(db_index=True, blank=False,
-                           max_length=43, validators=[UidValidator])
+                           max_length=43, validators=[validate_uid])
     collection = models.ForeignKey(Collection, related_name='items', on_delete=models.CASCADE)
     version = models.PositiveSmallIntegerField()
     encryptionKey = models.BinaryField(editable=True, blank=False, null=True)
@@ -112,7 +118,7 @@ def chunk_directory_path(instance, filename):
 
 class CollectionItemChunk(models.Model):
     uid = models.CharField(db_index=True, blank=False, null=False,
-                           max_length=60, validators=[UidValidator])
+                           max_length=60, validators=[validate_uid])
     collection = models.ForeignKey(Collection, related_name='chunks', on_delete=models.CASCADE)
     chunkFile = models.FileField(upload_to=chunk_directory_path, max_length=150, unique=True)
 
@@ -129,13 +135,13 @@ def generate_stoken_uid():
 
 class Stoken(models.Model):
     uid = models.CharField(db_index=True, unique=True, blank=False, null=False, default=generate_stoken_uid,
-                           max_length=43, validators=[UidValidator])
+                           max_length=43, validators=[validate_uid])
 
 
 class CollectionItemRevision(models.Model):
     stoken = models.OneToOneField(Stoken, on_delete=models.PROTECT)
     uid = models.CharField(db_index=True, unique=True, blank=False, null=False,
-                           max_length=43, validators=[UidValidator])
+                           max_length=43, validators=[validate_uid])
     item = models.ForeignKey(CollectionItem, related_name='revisions', on_delete=models.CASCADE)
     meta = models.BinaryField(editable=True, blank=False, null=False)
     current = models.BooleanField(db_index=True, default=True, null=True)
@@ -205,7 +211,7 @@ class CollectionMemberRemoved(models.Model):
 
 class CollectionInvitation(models.Model):
     uid = models.CharField(db_index=True, blank=False, null=False,
-                           max_length=43, validators=[UidValidator])
+                           max_length=43, validators=[validate_uid])
     version = models.PositiveSmallIntegerField(default=1)
     fromMember = models.ForeignKey(CollectionMember, on_delete=models.CASCADE)
     # FIXME: make sure to delete all invitations for the same collection once one is accepted
@@ -12,13 +12,19 @@
 # You should have received a copy of the GNU General Public License
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 
-import base64
+try:
+    # A drop-in replacement for the stdlib module with SIMD acceleration
+    import pybase64 as base64
+except ImportError:
+    import base64
+from concurrent.futures import ThreadPoolExecutor
 
 from django.core.files.base import ContentFile
 from django.core import exceptions as django_exceptions
 from django.contrib.auth import get_user_model
-from django.db import IntegrityError, transaction
+from django.db import IntegrityError, connection, transaction
 from rest_framework import serializers, status
+from rest_framework.relations import MANY_RELATION_KWARGS
 from . import models
 from .utils import get_user_queryset, create_user
 
@@ -27,45 +33,99 @@ from .exceptions import EtebaseValidationError
 User = get_user_model()
 
 
-def process_revisions_for_item(item, revision_data):
+def process_revisions_for_item(item, revision_data, stoken=None):
     chunks_objs = []
+    new_chunks = []
     chunks = revision_data.pop('chunks_relation')
 
     revision = models.CollectionItemRevision(**revision_data, item=item)
-    revision.validate_unique()  # Verify there aren't any validation issues
+
+    # Prefetch the referenced chunks with one query instead of one per chunk. The uid is only
+    # unique per collection so we can't use in_bulk, but keeping the first match per uid is
+    # equivalent to the .filter(uid=uid).first() this replaces.
+    existing_chunks = {}
+    for chunk_obj in models.CollectionItemChunk.objects.filter(
+            uid__in=[chunk[0] for chunk in chunks]).order_by('id'):
+        existing_chunks.setdefault(chunk_obj.uid, chunk_obj)
 
     for chunk in chunks:
         uid = chunk[0]
-        chunk_obj = models.CollectionItemChunk.objects.filter(uid=uid).first()
+        chunk_obj = existing_chunks.get(uid, None)
         if len(chunk) > 1:
             content = chunk[1]
             # If the chunk already exists we assume it's fine. Otherwise, we upload it.
             if chunk_obj is None:
                 chunk_obj = models.CollectionItemChunk(uid=uid, collection=item.collection)
-                chunk_obj.chunkFile.save('IGNORED', ContentFile(content))
-                chunk_obj.save()
+                new_chunks.append((chunk_obj, content))
+                existing_chunks[uid] = chunk_obj
         else:
             if chunk_obj is None:
                 raise EtebaseValidationError('chunk_no_content', 'Tried to create a new chunk without content')
 
         chunks_objs.append(chunk_obj)
 
-    stoken = models.Stoken.objects.create()
-    revision.stoken = stoken
-    revision.save()
+    def save_chunk_file(new_chunk):
+        chunk_obj, content = new_chunk
+        # Only save the file itself here, the rows are inserted in bulk below
+        chunk_obj.chunkFile.save('IGNORED', ContentFile(content), save=False)
+
+    if len(new_chunks) > 1:
+        # Resolve the upload path components up front so the worker threads, which write the
+        # chunk files in parallel, never have to touch the database.
+        item.collection.owner
+        item.collection.uid
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(save_chunk_file, new_chunks))
+    else:
+        for new_chunk in new_chunks:
+            save_chunk_file(new_chunk)
 
-    for chunk in chunks_objs:
-        models.RevisionChunkRelation.objects.create(chunk=chunk, revision=revision)
+    if connection.features.can_return_rows_from_bulk_insert:
+        models.CollectionItemChunk.objects.bulk_create([chunk_obj for chunk_obj, _ in new_chunks], batch_size=500)
+    else:
+        # We need the chunk ids for the relations below, so fall back to one insert per
+        # chunk on backends that can't return them from a bulk insert (e.g. sqlite)
+        for chunk_obj, _ in new_chunks:
+            chunk_obj.save()
+
+    if stoken is None:
+        stoken = models.Stoken.objects.create()
+    revision.stoken = stoken
+    try:
+        # Rely on the database's unique constraints instead of issuing a pre-flight SELECT
+        # per constraint, making the revision creation a single INSERT round-trip.
+        revision.save()
+    except IntegrityError:
+        raise EtebaseValidationError('unique_uid', 'Revision with this uid already exists',
+                                     status_code=status.HTTP_409_CONFLICT)
+
+    # No explicit batch_size: the backend's own maximum is used, so the relations go in
+    # with a single multi-row INSERT statement.
+    models.RevisionChunkRelation.objects.bulk_create(
+        [models.RevisionChunkRelation(chunk=chunk, revision=revision) for chunk in chunks_objs])
     return revision
 
 
 def b64encode(value):
-    return base64.urlsafe_b64encode(value).decode('ascii').strip('=')
+    # Strip the padding while still on bytes, it's much cheaper than on the decoded str
+    return base64.urlsafe_b64encode(value).rstrip(b'=').decode('ascii')
 
 
 def b64decode(data):
-    data += "=" * ((4 - len(data) % 4) % 4)
-    return base64.urlsafe_b64decode(data)
+    if isinstance(data, str):
+        data = data.encode('ascii')
+    return base64.urlsafe_b64decode(data + b'==='[:-len(data) & 3])
+
+
+def get_current_membership(instance, user):
+    """Get the collection membership of a user, preferring the per-request prefetch when present"""
+    my_membership = getattr(instance, '_my_membership', None)
+    if my_membership is not None:
+        return my_membership[0] if my_membership else None
+    # Memoize the fallback lookup so the other fields serializing this instance reuse it
+    membership = instance.members.get(user=user)
+    instance._my_membership = [membership]
+    return membership
 
 
 def b64decode_or_bytes(data):
@@ -76,18 +136,30 @@ def b64decode_or_bytes(data):
 
 
 class BinaryBase64Field(serializers.Field):
-    def to_representation(self, value):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        # Repeated values (e.g. collection types) only get decoded once per serialization
+        self._decode_cache = {}
+
+    # A staticmethod skips binding a method object per serialized value on this hot path
+    @staticmethod
+    def to_representation(value):
         return value
 
     def to_internal_value(self, data):
-        return b64decode_or_bytes(data)
+        if isinstance(data, bytes):
+            return data
+        value = self._decode_cache.get(data, None)
+        if value is None:
+            value = self._decode_cache[data] = b64decode(data)
+        return value
 
 
 class CollectionEncryptionKeyField(BinaryBase64Field):
     def get_attribute(self, instance):
         request = self.context.get('request', None)
         if request is not None:
-            return instance.members.get(user=request.user).encryptionKey
+            return get_current_membership(instance, request.user).encryptionKey
         return None
 
 
@@ -95,7 +167,7 @@ class CollectionTypeField(BinaryBase64Field):
     def get_attribute(self, instance):
         request = self.context.get('request', None)
         if request is not None:
-            collection_type = instance.members.get(user=request.user).collectionType
+            collection_type = get_current_membership(instance, request.user).collectionType
             return collection_type and collection_type.uid
         return None
 
@@ -112,7 +184,38 @@ class UserSlugRelatedField(serializers.SlugRelatedField):
         return super().to_internal_value(data.lower())
 
 
+class ChunksManyRelatedField(serializers.ManyRelatedField):
+    def to_representation(self, iterable):
+        if hasattr(iterable, 'select_related'):
+            # Only the uid and file name are serialized, so don't fetch the rest
+            iterable = iterable.select_related('chunk').only('chunk__uid', 'chunk__chunkFile')
+        relations = list(iterable)
+
+        if self.context.get('prefetch') != 'auto':
+            return [(relation.chunk.uid, ) for relation in relations]
+
+        def read_chunk(relation):
+            chunk = relation.chunk
+            with open(chunk.chunkFile.path, 'rb') as f:
+                return (chunk.uid, f.read())
+
+        if len(relations) <= 1:
+            return [read_chunk(relation) for relation in relations]
+
+        # Read the chunk files in parallel so we wait on the disk once, rather than once per chunk
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            return list(executor.map(read_chunk, relations))
+
+
 class ChunksField(serializers.RelatedField):
+    @classmethod
+    def many_init(cls, *args, **kwargs):
+        list_kwargs = {'child_relation': cls(*args, **kwargs)}
+        for key in kwargs:
+            if key in MANY_RELATION_KWARGS:
+                list_kwargs[key] = kwargs[key]
+        return ChunksManyRelatedField(**list_kwargs)
+
     def to_representation(self, obj):
         obj = obj.chunk
         if self.context.get('prefetch') == 'auto':
@@ -206,6 +309,21 @@ class CollectionItemRevisionSerializer(BetterErrorsMixin, serializers.ModelSeria
         }
 
 
+class CollectionItemListSerializer(serializers.ListSerializer):
+    def create(self, validated_data):
+        # Create the stokens for all of the items with one insert instead of one per item.
+        # Only possible when the backend hands back the generated ids (e.g. postgres).
+        if connection.features.can_return_rows_from_bulk_insert:
+            stokens = models.Stoken.objects.bulk_create([models.Stoken() for _ in validated_data])
+        else:
+            stokens = [None] * len(validated_data)
+
+        return [
+            self.child.create({**item_data, 'stoken': stoken})
+            for item_data, stoken in zip(validated_data, stokens)
+        ]
+
+
 class CollectionItemSerializer(BetterErrorsMixin, serializers.ModelSerializer):
     encryptionKey = BinaryBase64Field(required=False, default=None, allow_null=True)
     etag = serializers.CharField(allow_null=True, write_only=True)
@@ -214,10 +332,12 @@ class CollectionItemSerializer(BetterErrorsMixin, serializers.ModelSerializer):
     class Meta:
         model = models.CollectionItem
         fields = ('uid', 'version', 'encryptionKey', 'content', 'etag')
+        list_serializer_class = CollectionItemListSerializer
 
     def create(self, validated_data):
         """Function that's called when this serializer creates an item"""
         validate_etag = self.context.get('validate_etag', False)
+        stoken = validated_data.pop('stoken', None)
         etag = validated_data.pop('etag')
         revision_data = validated_data.pop('content')
         uid = validated_data.pop('uid')
@@ -225,11 +345,26 @@ class CollectionItemSerializer(BetterErrorsMixin, serializers.ModelSerializer):
         Model = self.__class__.Meta.model
 
         with transaction.atomic():
-            instance, created = Model.objects.get_or_create(uid=uid, defaults=validated_data)
+            if etag is None:
+                # The client claims the item is new, so skip the SELECT get_or_create leads
+                # with and just try to insert, falling back to a fetch on conflict.
+                try:
+                    with transaction.atomic():
+                        instance = Model.objects.create(uid=uid, **validated_data)
+                    created = True
+                except IntegrityError:
+                    instance = Model.objects.get(uid=uid)
+                    created = False
+            else:
+                instance, created = Model.objects.get_or_create(uid=uid, defaults=validated_data)
             cur_etag = instance.etag if not created else None
 
             # If we are trying to update an up to date item, abort early and consider it a success
             if cur_etag == revision_data.get('uid'):
+                if stoken is not None:
+                    # No revision gets written, so drop the pre-created stoken rather than
+                    # committing it as an orphan row.
+                    stoken.delete()
                 return instance
 
             if validate_etag and cur_etag != etag:
@@ -241,10 +376,10 @@ class CollectionItemSerializer(BetterErrorsMixin, serializers.ModelSerializer):
                 # the race condition. But it's a good idea because it'll lock and wait rather than fail.
                 current_revision = instance.revisions.filter(current=True).select_for_update().first()
                 current_revision.current = None
-                current_revision.save()
+                current_revision.save(update_fields=['current'])
 
             try:
-                process_revisions_for_item(instance, revision_data)
+                process_revisions_for_item(instance, revision_data, stoken)
             except django_exceptions.ValidationError as e:
                 self.transform_validation_error("content", e)
 
@@ -263,10 +398,13 @@ class CollectionItemDepSerializer(BetterErrorsMixin, serializers.ModelSerializer
         fields = ('uid', 'etag')
 
     def validate(self, data):
-        item = self.__class__.Meta.model.objects.get(uid=data['uid'])
+        # The etag is just the current revision's uid, so fetch only that rather than the
+        # item and its current revision with two separate queries
+        current_etag = models.CollectionItemRevision.objects.values_list('uid', flat=True).get(
+            item__uid=data['uid'], current=True)
         etag = data['etag']
-        if item.etag != etag:
-            raise EtebaseValidationError('wrong_etag', 'Wrong etag. Expected {} got {}'.format(item.etag, etag),
+        if current_etag != etag:
+            raise EtebaseValidationError('wrong_etag', 'Wrong etag. Expected {} got {}'.format(current_etag, etag),
                                          status_code=status.HTTP_409_CONFLICT)
 
         return data
@@ -301,7 +439,7 @@ class CollectionSerializer(BetterErrorsMixin, serializers.ModelSerializer):
     def get_access_level_from_context(self, obj):
         request = self.context.get('request', None)
         if request is not None:
-            return obj.members.get(user=request.user).accessLevel
+            return get_current_membership(obj, request.user).accessLevel
         return None
 
     def create(self, validated_data):
@@ -327,7 +465,7 @@ class CollectionSerializer(BetterErrorsMixin, serializers.ModelSerializer):
             instance.main_item = main_item
 
             instance.full_clean()
-            instance.save()
+            instance.save(update_fields=['main_item'])
 
             process_revisions_for_item(main_item, revision_data)
 
@@ -368,7 +506,7 @@ class CollectionMemberSerializer(BetterErrorsMixin, serializers.ModelSerializer)
             if instance.accessLevel != access_level:
                 instance.stoken = models.Stoken.objects.create()
                 instance.accessLevel = access_level
-                instance.save()
+                instance.save(update_fields=['stoken', 'accessLevel'])
 
         return instance
 
@@ -400,7 +538,7 @@ class CollectionInvitationSerializer(BetterErrorsMixin, serializers.ModelSeriali
         request = self.context['request']
         collection = validated_data.pop('collection')
 
-        member = collection.members.get(user=request.user)
+        member = get_current_membership(collection, request.user)
 
         with transaction.atomic():
             try:
@@ -412,7 +550,7 @@ class CollectionInvitationSerializer(BetterErrorsMixin, serializers.ModelSeriali
         with transaction.atomic():
             instance.accessLevel = validated_data.pop('accessLevel')
             instance.signedEncryptionKey = validated_data.pop('signedEncryptionKey')
-            instance.save()
+            instance.save(update_fields=['accessLevel', 'signedEncryptionKey'])
 
         return instance
 
@@ -567,6 +705,6 @@ class AuthenticationChangePasswordInnerSerializer(AuthenticationLoginInnerSerial
         with transaction.atomic():
             instance.loginPubkey = validated_data.pop('loginPubkey')
             instance.encryptedContent = validated_data.pop('encryptedContent')
-            instance.save()
+            instance.save(update_fields=['loginPubkey', 'encryptedContent'])
 
         return instance
@@ -18,10 +18,11 @@ from django.conf import settings
 from django.contrib.auth import get_user_model, user_logged_in, user_logged_out
 from django.core.exceptions import PermissionDenied
 from django.db import transaction, IntegrityError
-from django.db.models import Max, Value as V, Q
+from django.db.models import Max, Value as V, Q, Prefetch
 from django.db.models.functions import Coalesce, Greatest
-from django.http import HttpResponseBadRequest, HttpResponse, Http404
+from django.http import HttpResponseBadRequest, HttpResponse, FileResponse, Http404
 from django.shortcuts import get_object_or_404
+from django.utils.cache import patch_cache_control
 
 from rest_framework import status
 from rest_framework import viewsets
@@ -106,7 +107,10 @@ class BaseViewSet(viewsets.ModelViewSet):
 
     def get_collection_queryset(self, queryset=Collection.objects):
         user = self.request.user
-        return queryset.filter(members__user=user)
+        # Prefetch the requesting user's membership so the serializer fields don't have to
+        # fetch it once per field, per collection.
+        return queryset.filter(members__user=user).prefetch_related(
+            Prefetch('members', queryset=CollectionMember.objects.filter(user=user), to_attr='_my_membership'))
 
     def get_stoken_obj_id(self, request):
         return request.GET.get('stoken', None)
@@ -460,19 +464,17 @@ class CollectionItemChunkViewSet(viewsets.ViewSet):
 
     @action_decorator(detail=True, methods=['GET'])
     def download(self, request, collection_uid=None, collection_item_uid=None, uid=None, *args, **kwargs):
-        import os
-        from django.views.static import serve
-
         col = get_object_or_404(self.get_collection_queryset(), main_item__uid=collection_uid)
         # IGNORED FOR NOW: col_it = get_object_or_404(col.items, uid=collection_item_uid)
         chunk = get_object_or_404(col.chunks, uid=uid)
 
-        filename = chunk.chunkFile.path
-        dirname = os.path.dirname(filename)
-        basename = os.path.basename(filename)
-
-        # FIXME: DO NOT USE! Use django-send file or etc instead.
-        return serve(request, basename, dirname)
+        # Stream straight from the file so the WSGI server can send it with wsgi.file_wrapper
+        # (sendfile where supported) instead of buffering it through Python.
+        response = FileResponse(chunk.chunkFile.open('rb'), content_type='application/octet-stream')
+        # Chunks are content-addressed and never change, so clients can cache them forever
+        # and skip re-fetching (and re-encoding) them entirely.
+        patch_cache_control(response, max_age=31536000, private=True, immutable=True)
+        return response
 
 
 class CollectionMemberViewSet(BaseViewSet):